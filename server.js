@@ -1,16 +1,174 @@
 const express = require('express');
 const cors = require('cors');
 const axios = require('axios');
+const cluster = require('cluster');
+const crypto = require('crypto');
+const http = require('http');
+const https = require('https');
+const { pipeline } = require('stream');
 
 const app = express();
 const PORT = process.env.PORT || 3000;
+// Clustering is opt-in. Every worker has its own upstream pool, response
+// cache and concurrency limit, so those sizes are per worker, not per host.
+const WORKERS = parseInt(process.env.WEB_CONCURRENCY, 10) || 1;
+// A worker that dies sooner than this after being forked is treated as a
+// startup failure (bad port, bad config) and stops the whole server instead
+// of being respawned in a loop.
+const MIN_WORKER_UPTIME_MS = 5000;
+// console writes to files and TTYs are synchronous, so per-request error
+// logging can be switched off. LOG_LEVEL=silent or off disables it; any
+// other value (error, warn, info, ...) or none keeps it, since errors are
+// the only per-request logs.
+const LOG_ERRORS = !['silent', 'off'].includes((process.env.LOG_LEVEL || '').toLowerCase());
+
+// Completions are never revalidated, so skip hashing every JSON body for an ETag.
+app.set('etag', false);
+
+const PROXY_API_KEY = process.env.PROXY_API_KEY;
+const PROXY_TOKEN = PROXY_API_KEY ? Buffer.from(PROXY_API_KEY) : null;
+
+function authOk(header) {
+  if (!header || header.length < 8 || !header.startsWith('Bearer ')) {
+    return false;
+  }
+  const token = Buffer.from(header.slice(7));
+  return token.length === PROXY_TOKEN.length && crypto.timingSafeEqual(token, PROXY_TOKEN);
+}
 
 app.use(cors());
-app.use(express.json());
+
+// Client auth is opt-in: only enforced when PROXY_API_KEY is set. It is
+// attached to the /v1 routes only, so health checks never run it.
+function requireAuth(req, res, next) {
+  if (!PROXY_TOKEN || authOk(req.headers.authorization)) {
+    return next();
+  }
+  res.status(401).json({
+    error: {
+      message: 'Invalid API key',
+      type: 'invalid_request_error',
+      code: 401
+    }
+  });
+}
+
+// Parsed per route, after auth, so rejected callers never have their body read.
+// Long conversations routinely exceed body-parser's 100kb default; 2mb
+// leaves room for them without letting anonymous callers push huge bodies.
+const jsonBody = express.json({ limit: process.env.BODY_LIMIT || '2mb' });
 
 const NIM_API_BASE = process.env.NIM_API_BASE || 'https://integrate.api.nvidia.com/v1';
 const NIM_API_KEY = process.env.NIM_API_KEY;
 
+const UPSTREAM_HEADERS = { 'Content-Type': 'application/json' };
+if (NIM_API_KEY) {
+  UPSTREAM_HEADERS['Authorization'] = `Bearer ${NIM_API_KEY}`;
+}
+
+// One keep-alive client for every upstream call, so requests reuse pooled
+// sockets instead of paying a fresh TCP + TLS handshake each time. LIFO
+// scheduling keeps traffic on the most recently used (warmest) sockets and
+// lets the rest idle out: timeout destroys sockets idle for 30s.
+const AGENT_OPTIONS = {
+  keepAlive: true,
+  keepAliveMsecs: 30000,
+  timeout: 30000,
+  maxSockets: 512,
+  maxFreeSockets: 256,
+  scheduling: 'lifo'
+};
+
+// Cap in-flight upstream requests so bursts queue here, in order, rather
+// than piling up in the agent's socket queue. A slot is held until the
+// upstream body has been fully read or the stream closes. The cap is per
+// worker: with WEB_CONCURRENCY workers the host-wide total is cap x workers.
+const UPSTREAM_CONCURRENCY = parseInt(process.env.UPSTREAM_CONCURRENCY, 10) || 256;
+let upstreamInFlight = 0;
+const upstreamWaiters = [];
+
+function acquireUpstream() {
+  if (upstreamInFlight < UPSTREAM_CONCURRENCY) {
+    upstreamInFlight++;
+    return Promise.resolve();
+  }
+  return new Promise(resolve => upstreamWaiters.push(resolve));
+}
+
+function releaseUpstream() {
+  const next = upstreamWaiters.shift();
+  if (next) {
+    next();
+  } else {
+    upstreamInFlight--;
+  }
+}
+
+// Reasoning models can take minutes to return a non-streaming completion,
+// so upstream calls are unbounded (axios's default) unless NIM_TIMEOUT_MS
+// is set. Timeouts surface to the client as a 504.
+const NIM_TIMEOUT_MS = parseInt(process.env.NIM_TIMEOUT_MS, 10) || 0;
+const TIMEOUT_CODES = new Set(['ECONNABORTED', 'ETIMEDOUT']);
+
+const nim = axios.create({
+  baseURL: NIM_API_BASE,
+  timeout: NIM_TIMEOUT_MS,
+  httpAgent: new http.Agent(AGENT_OPTIONS),
+  httpsAgent: new https.Agent(AGENT_OPTIONS)
+});
+
+// Bounded LRU of response payloads for deterministic (temperature 0,
+// non-streaming) requests. Entries are never mutated; hits are re-stamped
+// with a fresh id and created time. Map keeps insertion order, so the
+// first key is always the least recently used.
+const RESPONSE_CACHE_SIZE = parseInt(process.env.RESPONSE_CACHE_SIZE ?? '1024', 10);
+const responseCache = new Map();
+
+function cacheGet(key) {
+  const payload = responseCache.get(key);
+  if (payload !== undefined) {
+    responseCache.delete(key);
+    responseCache.set(key, payload);
+  }
+  return payload;
+}
+
+function cacheSet(key, payload) {
+  responseCache.set(key, payload);
+  if (responseCache.size > RESPONSE_CACHE_SIZE) {
+    responseCache.delete(responseCache.keys().next().value);
+  }
+}
+
+// Deliberate approximation, not exact match: prompts differing only in
+// CRLF vs LF line endings or trailing newlines share a cache entry even
+// though they tokenize differently and could complete differently. This
+// stands in for an embedding-based near-duplicate tier. Indentation and
+// all other whitespace are kept.
+function normalizeContent(content) {
+  if (typeof content !== 'string') {
+    return content;
+  }
+  return content.replace(/\r\n?/g, '\n').replace(/\n+$/, '');
+}
+
+function cacheKeyFor(model, nimRequest) {
+  const messages = Array.isArray(nimRequest.messages)
+    ? nimRequest.messages.map(m => ({ ...m, content: normalizeContent(m?.content) }))
+    : nimRequest.messages;
+  const prompt = normalizeContent(nimRequest.prompt);
+  const canonical = JSON.stringify([model, { ...nimRequest, messages, prompt }]);
+  return crypto.createHash('blake2b512').update(canonical).digest('base64');
+}
+
+// X-Accel-Buffering stops nginx-style proxies from holding back tokens.
+const SSE_HEADERS = {
+  'Content-Type': 'text/event-stream',
+  'Cache-Control': 'no-cache',
+  'Connection': 'keep-alive',
+  'X-Accel-Buffering': 'no'
+};
+
 const MODEL_MAPPING = {
   'gpt-3.5-turbo': 'meta/llama-3.1-8b-instruct',
   'deepseek-v3': 'deepseek-ai/deepseek-v3.1',
@@ -21,7 +179,7 @@ app.get('/health', (req, res) => {
   res.json({ status: 'ok', service: 'OpenAI to NVIDIA NIM Proxy' });
 });
 
-app.get('/v1/models', (req, res) => {
+app.get('/v1/models', requireAuth, (req, res) => {
   const models = Object.keys(MODEL_MAPPING).map(model => ({
     id: model,
     object: 'model',
@@ -35,66 +193,152 @@ app.get('/v1/models', (req, res) => {
   });
 });
 
-app.post('/v1/chat/completions', async (req, res) => {
+// Chat and legacy text completions differ only in upstream path, the
+// prompt field and the response envelope; both go through proxyCompletion.
+const CHAT_COMPLETIONS = {
+  path: '/chat/completions',
+  input: 'messages',
+  object: 'chat.completion',
+  idPrefix: 'chatcmpl'
+};
+
+const TEXT_COMPLETIONS = {
+  path: '/completions',
+  input: 'prompt',
+  object: 'text_completion',
+  idPrefix: 'cmpl'
+};
+
+async function proxyCompletion(req, res, endpoint) {
+  let controller;
   try {
-    const { model, messages, temperature, max_tokens, stream } = req.body;
+    const { model, temperature, max_tokens, stream } = req.body;
     
     const nimModel = MODEL_MAPPING[model] || MODEL_MAPPING['gpt-3.5-turbo'];
     
     const nimRequest = {
       model: nimModel,
-      messages: messages,
-      temperature: temperature || 0.7,
+      [endpoint.input]: req.body[endpoint.input],
+      temperature: temperature ?? 0.7,
       max_tokens: max_tokens || 1024,
       stream: stream || false
     };
     
-    const response = await axios.post(`${NIM_API_BASE}/chat/completions`, nimRequest, {
-      headers: {
-        'Authorization': `Bearer ${NIM_API_KEY}`,
-        'Content-Type': 'application/json'
-      },
-      responseType: stream ? 'stream' : 'json'
-    });
+    const cacheKey = RESPONSE_CACHE_SIZE > 0 && !stream && nimRequest.temperature === 0
+      ? cacheKeyFor(model, nimRequest)
+      : null;
+    if (cacheKey) {
+      const cached = cacheGet(cacheKey);
+      if (cached !== undefined) {
+        return res.json({
+          ...cached,
+          id: `${endpoint.idPrefix}-${Date.now()}`,
+          created: Math.floor(Date.now() / 1000)
+        });
+      }
+    }
+    
+    controller = new AbortController();
+    res.on('close', () => controller.abort());
+    
+    await acquireUpstream();
+    let released = false;
+    const release = () => {
+      if (!released) {
+        released = true;
+        releaseUpstream();
+      }
+    };
+    // Don't spend the slot on a client that gave up while queued.
+    if (controller.signal.aborted) {
+      release();
+      return;
+    }
     
+    let response;
+    try {
+      response = await nim.post(endpoint.path, nimRequest, {
+        signal: controller.signal,
+        headers: UPSTREAM_HEADERS,
+        responseType: stream ? 'stream' : 'arraybuffer',
+        validateStatus: null
+      });
+    } catch (error) {
+      release();
+      throw error;
+    }
     if (stream) {
-      res.setHeader('Content-Type', 'text/plain');
-      res.setHeader('Cache-Control', 'no-cache');
-      res.setHeader('Connection', 'keep-alive');
-      response.data.pipe(res);
+      response.data.once('close', release);
     } else {
-      const openaiResponse = {
-        id: `chatcmpl-${Date.now()}`,
-        object: 'chat.completion',
-        created: Math.floor(Date.now() / 1000),
-        model: model,
-        choices: response.data.choices.map(choice => ({
-          index: choice.index,
-          message: choice.message,
-          finish_reason: choice.finish_reason
-        })),
-        usage: response.data.usage || {
-          prompt_tokens: 0,
-          completion_tokens: 0,
-          total_tokens: 0
+      release();
+    }
+    
+    if (response.status >= 400) {
+      // NIM already reports errors in the OpenAI shape; relay the raw body
+      // instead of decoding it and re-wrapping a generic message.
+      res.status(response.status);
+      res.type(response.headers['content-type'] || 'application/json');
+      if (stream) {
+        pipeline(response.data, res, () => {});
+      } else {
+        res.send(response.data);
+      }
+      return;
+    }
+    
+    if (stream) {
+      res.set(SSE_HEADERS);
+      res.flushHeaders();
+      // Pass the upstream bytes through untouched; pipeline tears down both
+      // sides if either the client or NIM drops mid-stream.
+      pipeline(response.data, res, (err) => {
+        if (LOG_ERRORS && err && err.code !== 'ERR_STREAM_PREMATURE_CLOSE') {
+          console.error('Stream error:', err.message);
         }
+      });
+    } else {
+      // NIM already answers in the OpenAI shape; patch the envelope in place
+      // rather than rebuilding the response and every choice.
+      const openaiResponse = JSON.parse(response.data.toString());
+      openaiResponse.id = `${endpoint.idPrefix}-${Date.now()}`;
+      openaiResponse.object = endpoint.object;
+      openaiResponse.created = Math.floor(Date.now() / 1000);
+      openaiResponse.model = model;
+      openaiResponse.usage = openaiResponse.usage || {
+        prompt_tokens: 0,
+        completion_tokens: 0,
+        total_tokens: 0
       };
       
+      if (cacheKey) {
+        cacheSet(cacheKey, openaiResponse);
+      }
       res.json(openaiResponse);
     }
     
   } catch (error) {
-    console.error('Proxy error:', error.message);
+    // The client hung up; there is nobody left to log for or answer.
+    if (axios.isCancel(error) || controller?.signal.aborted) {
+      return;
+    }
+    if (LOG_ERRORS) {
+      console.error('Proxy error:', error.message);
+    }
     
-    res.status(error.response?.status || 500).json({
+    const timedOut = TIMEOUT_CODES.has(error.code);
+    const status = timedOut ? 504 : error.response?.status || 500;
+    res.status(status).json({
       error: {
         message: error.message || 'Internal server error',
-        type: 'invalid_request_error',
-        code: error.response?.status || 500
+        type: timedOut ? 'timeout_error' : 'invalid_request_error',
+        code: status
       }
     });
   }
-});
+}
+
+app.post('/v1/chat/completions', requireAuth, jsonBody, (req, res) => proxyCompletion(req, res, CHAT_COMPLETIONS));
+app.post('/v1/completions', requireAuth, jsonBody, (req, res) => proxyCompletion(req, res, TEXT_COMPLETIONS));
 
 app.all('*', (req, res) => {
   res.status(404).json({
@@ -106,7 +350,54 @@ app.all('*', (req, res) => {
   });
 });
 
-app.listen(PORT, () => {
+// Malformed or oversized bodies are rejected by express.json before any
+// route runs; answer in the OpenAI error shape instead of Express's HTML page.
+app.use((err, req, res, next) => {
+  if (res.headersSent) {
+    return next(err);
+  }
+  const status = err.status || 500;
+  res.status(status).json({
+    error: {
+      message: err.type === 'entity.parse.failed'
+        ? 'Invalid JSON in request body'
+        : err.message || 'Internal server error',
+      type: 'invalid_request_error',
+      code: status
+    }
+  });
+});
+
+function logStartup() {
   console.log(`OpenAI to NVIDIA NIM Proxy running on port ${PORT}`);
   console.log(`Health check: http://localhost:${PORT}/health`);
-});
+}
+
+// Each worker is its own process with its own upstream pool; the primary
+// only supervises and shares the listening socket.
+if (WORKERS > 1 && cluster.isPrimary) {
+  const forkWorker = () => {
+    cluster.fork().startedAt = Date.now();
+  };
+  for (let i = 0; i < WORKERS; i++) {
+    forkWorker();
+  }
+  cluster.on('exit', (worker, code, signal) => {
+    if (worker.exitedAfterDisconnect) {
+      return;
+    }
+    const reason = signal || code;
+    if (Date.now() - worker.startedAt < MIN_WORKER_UPTIME_MS) {
+      console.error(`Worker ${worker.process.pid} exited (${reason}) during startup, shutting down`);
+      process.exit(1);
+    }
+    console.error(`Worker ${worker.process.pid} exited (${reason}), restarting`);
+    forkWorker();
+  });
+  logStartup();
+  console.log(`Workers: ${WORKERS}`);
+} else if (WORKERS > 1) {
+  app.listen(PORT);
+} else {
+  app.listen(PORT, logStartup);
+}